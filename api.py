@@ -2,16 +2,27 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import functools
 import json
 import datetime
 import logging
 import hashlib
+import os
+import signal
+import threading
+import time
 import uuid
+import zlib
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
 import re
 from scoring import get_score, get_interests
-from store import Store
+from store import Store, POOL_SIZE, BATCH_WINDOW, BATCH_SIZE, PIN_TTL, PIN_THRESHOLD
+from hotkeys import TOP_K
+from sharedcache import SharedScoreCache, SLOTS
+import cache_keys
+import tracing
+from codec import CODECS
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -22,12 +33,14 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 UNKNOWN = 0
 MALE = 1
@@ -39,6 +52,17 @@ GENDERS = {
 }
 DEFAULT_CACHE_CLIENT = 'memcache'
 DEFAULT_CACHE_ADDRESS = '127.0.0.1'
+DEFAULT_CACHE_CODEC = 'binary'
+WARM_UP_RETRY_DELAY = 1
+WARM_UP_RETRY_DELAY_MAX = 30
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+STREAM_CHUNK_SIZE = 64 * 1024
+# zlib window bits producing each content coding
+ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
 
 
 class BaseField:
@@ -121,37 +145,77 @@ class EmailField(CharField):
 
 class PhoneField(BaseField):
     phone_error = 'Is not phone number'
-    phone_template = r"7\d{10}"
+    phone_template = re.compile(r"7\d{10}")
 
     def clean(self):
         value = self.value
         if isinstance(value, int):
             value = str(value)
         if isinstance(value, str):
-            if not re.match(self.phone_template, value):
+            if not self.phone_template.match(value):
                 self.errors.append(self.phone_error)
         else:
             self.errors.append(self.phone_error)
 
 
+# the same groups strptime builds for '%d.%m.%Y'
+DATE_TEMPLATE = re.compile(r"(3[01]|[12]\d|0[1-9]|[1-9]| [1-9])\.(1[0-2]|0[1-9]|[1-9])\.(\d\d\d\d)",
+                           re.IGNORECASE)
+DATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date(date_string):
+    match = DATE_TEMPLATE.fullmatch(date_string)
+    if match is None:
+        return None
+    day, month, year = match.groups()
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def parse_date(date_string):
+    # a drop-in for strptime(date_string, '%d.%m.%Y').date() that remembers recent strings
+    if not isinstance(date_string, str):
+        raise TypeError('Date must be a string')
+    value = _parse_date(date_string)
+    if value is None:
+        raise ValueError(f'Is not a dd.mm.yyyy date: {date_string!r}')
+    return value
+
+
 class DateField(BaseField):
     data_error = 'Is note date'
 
     def clean(self):
         try:
-            date_string = self.value
-            self.value = datetime.datetime.strptime(date_string, '%d.%m.%Y').date()
+            self.value = parse_date(self.value)
         except (ValueError, TypeError):
             self.errors.append(self.data_error)
 
 
 class BirthDayField(DateField):
     birthday_error = 'Not a birthday'
+    cutoff = None
+    cutoff_expires_at = 0
+
+    @classmethod
+    def get_cutoff(cls):
+        now = time.time()
+        if now >= cls.cutoff_expires_at:
+            today = datetime.date.fromtimestamp(now)
+            tomorrow = today + datetime.timedelta(days=1)
+            midnight = datetime.datetime.combine(tomorrow, datetime.time.min)
+            cls.cutoff = today - datetime.timedelta(days=365 * 70)
+            cls.cutoff_expires_at = midnight.timestamp()
+        return cls.cutoff
 
     def clean(self):
         super().clean()
         try:
-            if self.value < datetime.datetime.now().date() - datetime.timedelta(days=365 * 70):
+            if self.value < self.get_cutoff():
                 self.errors.append(self.birthday_error)
         except (ValueError, TypeError):
             self.errors.append(self.birthday_error)
@@ -345,22 +409,43 @@ def clients_interests_handler(arguments, is_admin, ctx, store):
     return response, code
 
 
+def hot_keys_handler(arguments, is_admin, ctx, store):
+    if not is_admin:
+        return 'admin only', FORBIDDEN
+    hot_keys = store.hot_keys.top_keys() if store.hot_keys else []
+    ctx['nkeys'] = len(hot_keys)
+    return {'keys': hot_keys}, OK
+
+
+def store_stats_handler(arguments, is_admin, ctx, store):
+    if not is_admin:
+        return 'admin only', FORBIDDEN
+    return store.stats(), OK
+
+
 def method_handler(request, ctx, store):
     handler_router = {
         'online_score': online_score_handler,
-        'clients_interests': clients_interests_handler
+        'clients_interests': clients_interests_handler,
+        'hot_keys': hot_keys_handler,
+        'store_stats': store_stats_handler,
     }
     body = request['body']
     method_request = MethodRequest(body)
-    if method_request.is_valid():
-        if check_auth(method_request):
+    with tracing.span('validate'):
+        is_valid = method_request.is_valid()
+    if is_valid:
+        with tracing.span('auth'):
+            is_authorized = check_auth(method_request)
+        if is_authorized:
             if method_request.method.value in handler_router:
-                response, code = handler_router[method_request.method.value](
-                    method_request.arguments.value,
-                    method_request.is_admin,
-                    ctx,
-                    store
-                )
+                with tracing.span('handler', method=method_request.method.value):
+                    response, code = handler_router[method_request.method.value](
+                        method_request.arguments.value,
+                        method_request.is_admin,
+                        ctx,
+                        store
+                    )
             else:
                 response, code = 'method not found', NOT_FOUND
         else:
@@ -370,23 +455,176 @@ def method_handler(request, ctx, store):
     return response, code
 
 
-def make_handler_class(opts):
-    class MainHTTPHandler(BaseHTTPRequestHandler):
+def choose_encoding(accept_encoding):
+    preferences = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        preferences[name.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = preferences.get(encoding, preferences.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def make_compressor(encoding, level):
+    return zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+
+
+def compress(body, encoding, level=COMPRESS_LEVEL):
+    compressor = make_compressor(encoding, level)
+    return compressor.compress(body) + compressor.flush()
+
+
+def make_store(opts, shared_cache=None):
+    return Store(opts.cache_type, opts.cache_address, opts.cache_port,
+                 codec=CODECS[opts.cache_codec](), pool_size=opts.cache_pool_size,
+                 hedge_delay=opts.cache_hedge_delay, batch_window=opts.cache_batch_window,
+                 batch_size=opts.cache_batch_size, hot_keys_top=opts.hot_keys_top,
+                 pin_ttl=opts.hot_keys_pin_ttl, pin_threshold=opts.hot_keys_pin_threshold,
+                 shared_cache=shared_cache, fallback_path=opts.cache_fallback)
+
+
+def warm_up_validators():
+    # runs DATE_TEMPLATE and the PhoneField regex once and seeds the _parse_date memo,
+    # so that the first requests skip that work
+    OnlineScoreRequest({"phone": "79175002040", "email": "user@otus.ru", "first_name": "a",
+                        "last_name": "b", "birthday": "01.01.1990", "gender": MALE}).is_valid()
+    ClientsInterestsRequest({"client_ids": [1], "date": "01.01.2020"}).is_valid()
+
+
+def stop_server(signum, frame):
+    # SIGTERM would end the process without the cleanup below, so it stops the server like Ctrl-C
+    raise KeyboardInterrupt
+
+
+def warm_up_store(store, ready, preload_path=None):
+    delay = WARM_UP_RETRY_DELAY
+    while True:
+        healthy = store.warm_up()
+        if healthy:
+            break
+        logging.warning(f"Cache is unreachable, retrying warm-up in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_DELAY_MAX)
+    logging.info(f"Warmed up {healthy} cache connections")
+    if preload_path:
+        # preloading only saves the first misses, so a bad key list must not keep /ready at 503
+        try:
+            with open(preload_path, encoding='utf-8') as keys_file:
+                keys = [line.strip() for line in keys_file if line.strip()]
+            logging.info(f"Preloaded {store.preload(keys)} of {len(keys)} hot keys")
+        except Exception as error:
+            logging.exception(f"Could not preload hot keys from {preload_path}: {error}")
+    ready.set()
+
+
+class BaseAPIHandler(BaseHTTPRequestHandler):
+    ready = threading.Event()
+    compress_min_size = COMPRESS_MIN_SIZE
+    compress_level = COMPRESS_LEVEL
+    compress_stream = False
+
+    def do_GET(self):
+        path = self.path.strip("/")
+        if path == "health":
+            code, status = OK, "ok"
+        elif path == "ready" and self.ready.is_set():
+            code, status = OK, "ready"
+        elif path == "ready":
+            code, status = SERVICE_UNAVAILABLE, "warming up"
+        else:
+            code, status = NOT_FOUND, ERRORS[NOT_FOUND]
+        body = json.dumps({"status": status, "code": code}).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_body(self, data):
+        encoding = None
+        if self.compress_min_size >= 0:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding and self.compress_stream:
+            self.write_stream(data, encoding)
+            return
+        body = json.dumps(data).encode('utf-8')
+        if encoding and len(body) >= self.compress_min_size:
+            body = compress(body, encoding, self.compress_level)
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_stream(self, data, encoding):
+        chunks = json.JSONEncoder().iterencode(data)
+        head, size = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.compress_min_size:
+                break
+        else:
+            body = ''.join(head).encode('utf-8')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # the length is unknown until the end, so the body runs until the connection closes
+        self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        compressor = make_compressor(encoding, self.compress_level)
+        buffer, size = head, 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_SIZE:
+                self.wfile.write(compressor.compress(''.join(buffer).encode('utf-8')))
+                buffer, size = [], 0
+        self.wfile.write(compressor.compress(''.join(buffer).encode('utf-8')) + compressor.flush())
+
+
+def make_handler_class(opts, cache_store):
+    class MainHTTPHandler(BaseAPIHandler):
         router = {
             "method": method_handler,
         }
-        store = Store(opts.cache_type, opts.cache_address, opts.cache_port)
+        store = cache_store
+        ready = threading.Event()
+        compress_min_size = opts.compress_min_size
+        compress_level = opts.compress_level
+        compress_stream = opts.compress_stream
+        tracer = tracing.Tracer(
+            tracing.JsonLinesExporter(opts.trace_file) if opts.trace_file else None)
 
         def get_request_id(self, headers):
-            return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+            return headers.get('X-Request-Id') or uuid.uuid4().hex
 
         def do_POST(self):
-            response, code = {}, OK
             context = {"request_id": self.get_request_id(self.headers)}
+            trace_id, parent_id = tracing.parse_traceparent(self.headers.get('traceparent'))
+            with self.tracer.start_trace(f"POST {self.path}", trace_id, parent_id,
+                                         request_id=context['request_id']) as root_span:
+                code = self.handle_post(context)
+                root_span.set('code', code)
+
+        def handle_post(self, context):
+            response, code = {}, OK
             request = None
             try:
-                data_string = (self.rfile.read(int(self.headers['Content-Length'])))
-                request = json.loads(data_string)
+                with tracing.span('parse'):
+                    data_string = (self.rfile.read(int(self.headers['Content-Length'])))
+                    request = json.loads(data_string)
             except Exception as err:
                 logging.exception(err)
                 code = BAD_REQUEST
@@ -406,15 +644,16 @@ def make_handler_class(opts):
 
             self.send_response(code)
             self.send_header("Content-Type", "application/json")
-            self.end_headers()
+            self.send_header("X-Request-Id", context['request_id'])
             if code not in ERRORS:
                 data = {"response": response, "code": code}
             else:
                 data = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
             context.update(data)
             logging.info(context)
-            self.wfile.write(json.dumps(data).encode('utf-8'))
-            return
+            with tracing.span('write'):
+                self.write_body(data)
+            return code
 
     return MainHTTPHandler
 
@@ -423,18 +662,62 @@ if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-t", "--threaded", action="store_true", default=False)
+    op.add_option("-w", "--workers", action="store", type=int, default=1)
+    op.add_option("--shared_cache_slots", action="store", type=int, default=SLOTS)
     op.add_option("-c", "--cache_address", action="store", default=DEFAULT_CACHE_ADDRESS)
     op.add_option("-k", "--cache_type", action="store", default=DEFAULT_CACHE_CLIENT)
     op.add_option("--cache_port", action="store", default=11211)
+    op.add_option("--cache_fallback", action="store", default=None)
+    op.add_option("--cache_pool_size", action="store", type=int, default=POOL_SIZE)
+    op.add_option("--cache_hedge_delay", action="store", type=float, default=None)
+    op.add_option("--cache_batch_window", action="store", type=float, default=BATCH_WINDOW)
+    op.add_option("--cache_batch_size", action="store", type=int, default=BATCH_SIZE)
+    op.add_option("--hot_keys_top", action="store", type=int, default=TOP_K)
+    op.add_option("--hot_keys_pin_ttl", action="store", type=float, default=PIN_TTL)
+    op.add_option("--hot_keys_pin_threshold", action="store", type=int, default=PIN_THRESHOLD)
+    op.add_option("--compress_min_size", action="store", type=int, default=COMPRESS_MIN_SIZE)
+    op.add_option("--compress_level", action="store", type=int, default=COMPRESS_LEVEL)
+    op.add_option("--compress_stream", action="store_true", default=False)
+    op.add_option("--trace_file", action="store", default=None)
+    op.add_option("--preload_keys", action="store", default=None)
+    op.add_option("--score_dual_read", action="store", type=float, default=0)
+    op.add_option("--cache_codec", action="store", choices=list(CODECS),
+                  default=DEFAULT_CACHE_CODEC)
     (opts, args) = op.parse_args()
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s',
                         datefmt='%Y.%m.%d %H:%M:%S')
-    MainHTTPHandler = make_handler_class(opts)
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    shared_cache = None
+    if opts.workers > 1 and opts.shared_cache_slots:
+        shared_cache = SharedScoreCache(opts.shared_cache_slots)
+    # seconds to keep reading legacy score keys after a deploy that changed them
+    cache_keys.enable_dual_read(opts.score_dual_read)
+    warm_up_validators()
+    MainHTTPHandler = make_handler_class(opts, make_store(opts, shared_cache))
+    server_class = ThreadingHTTPServer if opts.threaded else HTTPServer
+    server = server_class(("localhost", opts.port), MainHTTPHandler)
+    signal.signal(signal.SIGTERM, stop_server)
+    is_parent = True
+    for _ in range(opts.workers - 1):
+        if os.fork() == 0:
+            is_parent = False
+            break
+    # connections are opened after the fork so that workers never share sockets;
+    # pooled connections are not tied to a thread, so the ones warmed here serve
+    # every request thread, and /ready answers 503 until the warm-up finishes
+    threading.Thread(target=warm_up_store, daemon=True,
+                     args=(MainHTTPHandler.store, MainHTTPHandler.ready, opts.preload_keys)).start()
     logging.info(f"Starting server at {opts.port}")
     try:
         server.serve_forever()
+    except KeyboardInterrupt:
+        pass
     except Exception as error:
         logging.exception(f"Unexpected error: {error}")
     server.server_close()
+    # flushes writes the fallback tier and the trace exporter still buffer
+    MainHTTPHandler.store.close()
+    MainHTTPHandler.tracer.flush()
+    if shared_cache:
+        shared_cache.close(unlink=is_parent)
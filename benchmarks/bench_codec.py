@@ -0,0 +1,38 @@
+import json
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from codec import BinaryCodec  # noqa: E402
+
+NUMBER = 100000
+SAMPLES = {
+    'score': 3.5,
+    'interests': ['cars', 'pets', 'travel'],
+    'interests x40': ['hi-tech', 'sport', 'music', 'books'] * 10,
+}
+
+
+def measure(name, encode, decode, value):
+    data = encode(value)
+    size = len(data.encode('utf-8') if isinstance(data, str) else data)
+    seconds = timeit.timeit(lambda: decode(data), number=NUMBER)
+    print(f"{name:<16}{size:>8}{seconds / NUMBER * 1e9:>12.0f}")
+
+
+def main():
+    binary = BinaryCodec()
+    for sample, value in SAMPLES.items():
+        print(f"\n{sample}\n{'format':<16}{'bytes':>8}{'decode ns':>12}")
+        # python-memcached pickles non-string values with protocol 0
+        measure('pickle', lambda v: pickle.dumps(v, 0), pickle.loads, value)
+        if isinstance(value, list):
+            measure('json', json.dumps, json.loads, value)
+        measure('binary', binary.encode, binary.decode, value)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from api import compress  # noqa: E402
+
+NUMBER = 20
+CLIENTS = (10, 100, 1000, 10000)
+LEVELS = (1, 6, 9)
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def make_response(clients):
+    # the shape clients_interests answers with
+    response = {cid: INTERESTS[cid % 7:cid % 7 + 3] for cid in range(clients)}
+    return json.dumps({"response": response, "code": 200}).encode('utf-8')
+
+
+def main():
+    print(f"{'clients':>8}{'encoding':>10}{'level':>7}{'bytes':>10}{'ratio':>8}{'cpu us':>10}")
+    for clients in CLIENTS:
+        body = make_response(clients)
+        print(f"{clients:>8}{'identity':>10}{'':>7}{len(body):>10}{1:>8.2f}{0:>10.0f}")
+        for encoding in ('gzip', 'deflate'):
+            for level in LEVELS:
+                size = len(compress(body, encoding, level))
+                seconds = timeit.timeit(lambda: compress(body, encoding, level), number=NUMBER)
+                print(f"{clients:>8}{encoding:>10}{level:>7}{size:>10}"
+                      f"{len(body) / size:>8.2f}{seconds / NUMBER * 1e6:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import datetime
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import api  # noqa: E402
+
+SYNTHETIC_REQUESTS = 100000
+
+
+def load_dates(path):
+    # one API request body per line, as logged by do_POST
+    dates = []
+    with open(path, encoding='utf-8') as requests_file:
+        for line in requests_file:
+            arguments = json.loads(line).get('arguments') or {}
+            for field in ('birthday', 'date'):
+                if isinstance(arguments.get(field), str):
+                    dates.append(arguments[field])
+    return dates
+
+
+def synthetic_dates():
+    # birthdays repeat across a client base; interest dates cluster around today
+    random.seed(0)
+    today = datetime.date.today()
+    birthdays = [(today - datetime.timedelta(days=random.randint(18 * 365, 69 * 365))).strftime('%d.%m.%Y')
+                 for _ in range(20000)]
+    recent = [(today - datetime.timedelta(days=days)).strftime('%d.%m.%Y') for days in range(30)]
+    dates = []
+    for _ in range(SYNTHETIC_REQUESTS):
+        if random.random() < 0.7:
+            dates.append(birthdays[int(random.paretovariate(1.2)) % len(birthdays)])
+        else:
+            dates.append(random.choice(recent))
+    return dates
+
+
+def strptime_clean(value):
+    try:
+        value = datetime.datetime.strptime(value, '%d.%m.%Y').date()
+        return value < datetime.datetime.now().date() - datetime.timedelta(days=365 * 70)
+    except (ValueError, TypeError):
+        return None
+
+
+def field_clean(value):
+    try:
+        return api.parse_date(value) < api.BirthDayField.get_cutoff()
+    except (ValueError, TypeError):
+        return None
+
+
+def uncached_clean(value):
+    try:
+        return api._parse_date.__wrapped__(value) < api.BirthDayField.get_cutoff()
+    except (ValueError, TypeError):
+        return None
+
+
+def main():
+    dates = load_dates(sys.argv[1]) if len(sys.argv) > 1 else synthetic_dates()
+    print(f"{len(dates)} dates, {len(set(dates))} distinct")
+    for name, clean in (('strptime', strptime_clean), ('no memo', uncached_clean), ('fast path', field_clean)):
+        seconds = timeit.timeit(lambda: [clean(value) for value in dates], number=1)
+        print(f"{name:<10}{seconds / len(dates) * 1e9:>8.0f} ns per date")
+
+
+if __name__ == "__main__":
+    main()
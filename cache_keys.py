@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import time
+
+# bump when the scoring formula changes so that old scores are never served
+SCORING_VERSION = 1
+DIGEST_SIZE = 12
+LEGACY = 'legacy'
+# namespaces that may be read on a miss while their entries expire; only list
+# those whose scores the current formula would reproduce
+DUAL_READ = (LEGACY,)
+# long enough for entries written before a deploy to expire
+DUAL_READ_PERIOD = 60 * 60
+
+# dual-read is off unless a deploy asks for it, and then only for a while
+_dual_read = ()
+_dual_read_until = 0
+
+
+def enable_dual_read(period=DUAL_READ_PERIOD, namespaces=DUAL_READ):
+    global _dual_read, _dual_read_until
+    _dual_read = tuple(namespaces) if period > 0 else ()
+    _dual_read_until = time.monotonic() + period
+
+
+def dual_read_namespaces():
+    if _dual_read and time.monotonic() < _dual_read_until:
+        return _dual_read
+    return ()
+
+
+def score_prefix(version=SCORING_VERSION):
+    return f"s{version}:"
+
+
+# the namespace of scores computed by the current formula
+SCORE_PREFIX = score_prefix()
+
+
+def _score_data(first_name, last_name, phone, birthday):
+    # the ordinal is much cheaper to format than strftime; NUL keeps fields apart
+    parts = (
+        first_name or "",
+        last_name or "",
+        str(phone) if phone else "",
+        str(birthday.toordinal()) if birthday is not None else "",
+    )
+    return "\0".join(parts).encode('utf-8')
+
+
+def score_key(first_name=None, last_name=None, phone=None, birthday=None, version=SCORING_VERSION):
+    digest = hashlib.blake2b(_score_data(first_name, last_name, phone, birthday), digest_size=DIGEST_SIZE)
+    return score_prefix(version) + base64.urlsafe_b64encode(digest.digest()).decode('ascii')
+
+
+def legacy_score_key(first_name=None, last_name=None, phone=None, birthday=None):
+    key_parts = [
+        first_name or "",
+        last_name or "",
+        str(phone) if phone else "",
+        birthday.strftime("%Y%m%d") if birthday is not None else "",
+    ]
+    data = "".join(key_parts)
+    return "uid:" + hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def score_keys(first_name=None, last_name=None, phone=None, birthday=None, dual_read=None):
+    if dual_read is None:
+        dual_read = dual_read_namespaces()
+    keys = [score_key(first_name, last_name, phone, birthday)]
+    for version in dual_read:
+        if version == LEGACY:
+            keys.append(legacy_score_key(first_name, last_name, phone, birthday))
+        else:
+            keys.append(score_key(first_name, last_name, phone, birthday, version))
+    return keys
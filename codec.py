@@ -0,0 +1,167 @@
+import functools
+import pickle
+import struct
+import zlib
+
+VERSION = 1
+# versions stay below tab so that bytes written by other clients, such as
+# JSON stored with flags 0, are never mistaken for an encoded value
+MAX_VERSION = 0x08
+COMPRESS_THRESHOLD = 512
+COMPRESS_LEVEL = 6
+
+KIND_FLOAT = 1
+KIND_INT = 2
+KIND_STRINGS = 3
+KIND_PICKLE = 4
+KIND_FLOAT32 = 5
+KIND_TAG_IDS = 6
+COMPRESSED = 0x80
+
+HEADER = struct.Struct('>BB')
+FLOAT = struct.Struct('>d')
+FLOAT32 = struct.Struct('>f')
+INT = struct.Struct('>q')
+COUNT = struct.Struct('>H')
+MAX_COUNT = 0xFFFF
+SEPARATOR = '\0'
+TAG_IDS_CACHE_SIZE = 4096
+# append only: stored values refer to tags by their position
+INTERESTS = (
+    "cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus",
+)
+
+
+class Vocabulary:
+    def __init__(self, tags):
+        if len(tags) > 0xFF:
+            raise ValueError('Vocabulary ids must fit into a byte')
+        self.tags = tuple(tags)
+        self.ids = {tag: tag_id for tag_id, tag in enumerate(self.tags)}
+        self._decode = functools.lru_cache(maxsize=TAG_IDS_CACHE_SIZE)(self._lookup)
+
+    def encode(self, items):
+        ids = self.ids
+        try:
+            return bytes([ids[item] for item in items])
+        except KeyError:
+            return None
+
+    def decode(self, packed):
+        return list(self._decode(packed))
+
+    def _lookup(self, packed):
+        try:
+            return tuple([self.tags[tag_id] for tag_id in packed])
+        except IndexError:
+            raise ValueError('Unknown tag id') from None
+
+
+INTERESTS_VOCABULARY = Vocabulary(INTERESTS)
+
+
+class RawCodec:
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+
+class BinaryCodec:
+    def __init__(self, compress_threshold=COMPRESS_THRESHOLD, compress_level=COMPRESS_LEVEL,
+                 vocabulary=INTERESTS_VOCABULARY):
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.vocabulary = vocabulary
+
+    def encode(self, value):
+        value_type = type(value)
+        if value_type is str:
+            # text stays readable for the loaders that fill i: keys directly
+            return value
+        if value_type is float:
+            kind, payload = self._encode_float(value)
+        elif value_type is int and -2 ** 63 <= value < 2 ** 63:
+            kind, payload = KIND_INT, INT.pack(value)
+        else:
+            kind, payload = self._encode_sequence(value)
+        if self.compress_threshold and len(payload) >= self.compress_threshold:
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) < len(payload):
+                kind, payload = kind | COMPRESSED, compressed
+        return HEADER.pack(VERSION, kind) + payload
+
+    def decode(self, value):
+        if type(value) is not bytes or len(value) < HEADER.size or value[0] > MAX_VERSION:
+            return value
+        version, kind = value[0], value[1]
+        if version != VERSION:
+            raise ValueError(f'Unsupported codec version: {version}')
+        if kind == KIND_FLOAT32:
+            return FLOAT32.unpack_from(value, HEADER.size)[0]
+        if kind == KIND_TAG_IDS:
+            return self._decode_tag_ids(value[HEADER.size:])
+        if kind & COMPRESSED:
+            return self._decode_payload(kind & ~COMPRESSED, zlib.decompress(value[HEADER.size:]), 0)
+        return self._decode_payload(kind, value, HEADER.size)
+
+    def _decode_payload(self, kind, payload, offset):
+        if kind == KIND_FLOAT32:
+            return FLOAT32.unpack_from(payload, offset)[0]
+        if kind == KIND_TAG_IDS:
+            return self._decode_tag_ids(payload[offset:])
+        if kind == KIND_STRINGS:
+            return self._decode_strings(payload, offset)
+        if kind == KIND_FLOAT:
+            return FLOAT.unpack_from(payload, offset)[0]
+        if kind == KIND_INT:
+            return INT.unpack_from(payload, offset)[0]
+        if kind == KIND_PICKLE:
+            return pickle.loads(payload[offset:])
+        raise ValueError(f'Unknown value kind: {kind}')
+
+    def _decode_tag_ids(self, packed):
+        if self.vocabulary is None:
+            raise ValueError('Tag ids need a vocabulary to decode')
+        return self.vocabulary.decode(packed)
+
+    @staticmethod
+    def _encode_float(value):
+        try:
+            payload = FLOAT32.pack(value)
+        except OverflowError:
+            return KIND_FLOAT, FLOAT.pack(value)
+        # scores are multiples of 0.5, which single precision holds exactly
+        if FLOAT32.unpack(payload)[0] == value:
+            return KIND_FLOAT32, payload
+        return KIND_FLOAT, FLOAT.pack(value)
+
+    def _encode_sequence(self, value):
+        if type(value) in (list, tuple) and all(type(item) is str for item in value):
+            payload = self.vocabulary.encode(value) if self.vocabulary else None
+            if payload is not None:
+                return KIND_TAG_IDS, payload
+            payload = self._encode_strings(value)
+            if payload is not None:
+                return KIND_STRINGS, payload
+        return KIND_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _encode_strings(items):
+        # a count prefix plus NUL separators lets decode split in one C call
+        if len(items) > MAX_COUNT or any(SEPARATOR in item for item in items):
+            return None
+        return COUNT.pack(len(items)) + SEPARATOR.join(items).encode('utf-8')
+
+    @staticmethod
+    def _decode_strings(payload, offset):
+        if not COUNT.unpack_from(payload, offset)[0]:
+            return []
+        return payload[offset + COUNT.size:].decode('utf-8').split(SEPARATOR)
+
+
+CODECS = {
+    'binary': BinaryCodec,
+    'raw': RawCodec,
+}
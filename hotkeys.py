@@ -0,0 +1,83 @@
+import heapq
+import threading
+import time
+
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+TOP_K = 20
+WINDOW = 60
+
+
+class CountMinSketch:
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key):
+        first = hash(key)
+        second = (first >> 32) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        estimate = None
+        for row, index in zip(self.rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+
+class HotKeyTracker:
+    def __init__(self, top_k=TOP_K, window=WINDOW, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.top_k = top_k
+        self.window = window
+        self.width = width
+        self.depth = depth
+        self.lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def _reset(self, now):
+        self.sketch = CountMinSketch(self.width, self.depth)
+        self.top = {}
+        # min-heap of (count, key); entries whose count no longer matches self.top are stale
+        self.heap = []
+        self.started_at = now
+
+    def add(self, key):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.started_at > self.window:
+                self._reset(now)
+            count = self.sketch.add(key)
+            if key not in self.top and len(self.top) >= self.top_k:
+                self._drop_stale()
+                if count <= self.heap[0][0]:
+                    return count
+                del self.top[heapq.heappop(self.heap)[1]]
+            self.top[key] = count
+            heapq.heappush(self.heap, (count, key))
+            if len(self.heap) > 4 * self.top_k:
+                self.heap = [(value, item) for item, value in self.top.items()]
+                heapq.heapify(self.heap)
+            return count
+
+    def _drop_stale(self):
+        while self.top.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def is_hot(self, key, threshold):
+        with self.lock:
+            return self.top.get(key, 0) >= threshold
+
+    def top_keys(self, limit=None):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started_at, 1)
+            ranked = sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+        return [
+            {'key': key, 'count': count, 'rate': round(count / elapsed, 2)}
+            for key, count in ranked[:limit]
+        ]
@@ -1,21 +1,28 @@
-import hashlib
 import json
 
+from cache_keys import score_keys
+
+SCORE_TTL = 60 * 60
+# loaded interests stay until the next load replaces them
+INTERESTS_TTL = 0
+
 
 def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
-    key_parts = [
-        first_name or "",
-        last_name or "",
-        phone or "",
-        birthday.strftime("%Y%m%d") if birthday is not None else "",
-    ]
-    data = "".join(key_parts)
-    key = "uid:" + hashlib.md5(data.encode('utf-8')).hexdigest()
+    keys = score_keys(first_name, last_name, phone, birthday)
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
-    score = store.cache_get(key) or 0
-    if score:
+    if len(keys) == 1:
+        score = store.cache_get(keys[0])
+    else:
+        # one round trip for the current and previous keys, and no retries
+        # since a miss only costs the calculation below
+        values = store.cache_get_many(keys)
+        score = next((values[key] for key in keys if key in values), None)
+        if score is not None and keys[0] not in values:
+            store.cache_set(keys[0], score, SCORE_TTL)
+    if score is not None:
         return score
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -25,10 +32,18 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
     if first_name and last_name:
         score += 0.5
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set(keys[0], score, SCORE_TTL)
     return score
 
 
 def get_interests(store, cid):
     r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    if isinstance(r, (str, bytes)):
+        return json.loads(r) if r else []
+    return r or []
+
+
+def set_interests(store, cid, interests, ttl=INTERESTS_TTL):
+    # loaders must write i: keys through here: the store's codec packs known
+    # tags as one byte each, which a JSON string written directly skips
+    return store.cache_set("i:%s" % cid, list(interests), ttl)
@@ -0,0 +1,64 @@
+import hashlib
+import struct
+import time
+
+SLOTS = 65536
+BUCKET_SIZE = 4
+STRIPES = 64
+TTL = 60
+
+# key digest, score, expiry as unix time, whether the score was an int;
+# an all-zero digest marks an empty slot
+SLOT = struct.Struct('16sdd?')
+EMPTY = bytes(16)
+
+
+class SharedScoreCache:
+    def __init__(self, slots=SLOTS, stripes=STRIPES):
+        # imported here so that single-process servers skip the cost
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self.buckets = max(slots // BUCKET_SIZE, 1)
+        # created before the workers fork so that every process shares them
+        self.memory = shared_memory.SharedMemory(create=True, size=self.buckets * BUCKET_SIZE * SLOT.size)
+        self.locks = [multiprocessing.Lock() for _ in range(stripes)]
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        if digest == EMPTY:
+            digest = b'\1' + digest[1:]
+        bucket = int.from_bytes(digest[:8], 'little') % self.buckets
+        return digest, bucket * BUCKET_SIZE * SLOT.size, self.locks[bucket % len(self.locks)]
+
+    def get(self, key):
+        digest, offset, lock = self._locate(key)
+        buffer = self.memory.buf
+        with lock:
+            for position in range(offset, offset + BUCKET_SIZE * SLOT.size, SLOT.size):
+                slot_digest, score, expires_at, integral = SLOT.unpack_from(buffer, position)
+                if slot_digest == digest:
+                    if expires_at <= time.time():
+                        return None
+                    return int(score) if integral else score
+        return None
+
+    def set(self, key, score, ttl=TTL):
+        digest, offset, lock = self._locate(key)
+        buffer = self.memory.buf
+        now = time.time()
+        with lock:
+            target, soonest = offset, None
+            for position in range(offset, offset + BUCKET_SIZE * SLOT.size, SLOT.size):
+                slot_digest, _, expires_at, _ = SLOT.unpack_from(buffer, position)
+                if slot_digest == digest or slot_digest == EMPTY or expires_at <= now:
+                    target = position
+                    break
+                # a full bucket gives up the entry closest to expiring
+                if soonest is None or expires_at < soonest:
+                    target, soonest = position, expires_at
+            SLOT.pack_into(buffer, target, digest, score, now + ttl, type(score) is int)
+
+    def close(self, unlink=True):
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
@@ -1,26 +1,169 @@
-import memcache
+import collections
+import contextlib
+import functools
+import pickle
+import re
+import socket
+import threading
+import time
+import zlib
+from concurrent import futures
+
+import tracing
+from cache_keys import SCORE_PREFIX
+from codec import BinaryCodec
+from hotkeys import HotKeyTracker, TOP_K
 
 MEMCACHE_PORT = 11211
+# up to 250 bytes without spaces or control characters
+MEMCACHE_KEY = re.compile(rb'[\x21-\x7e\x80-\xff]{1,250}')
+RECV_SIZE = 64 * 1024
+HEALTH_CHECK_INTERVAL = 30
+# python-memcached's value flags, so that either client reads what the other wrote
+FLAG_PICKLE = 1
+FLAG_INTEGER = 2
+FLAG_LONG = 4
+FLAG_COMPRESSED = 8
+FLAG_TEXT = 16
 RETRY_COUNT = 4
+NEGATIVE_CACHE_TTL = 30
+NEGATIVE_CACHE_SIZE = 10000
+POOL_SIZE = 4
+POOL_IDLE_TIMEOUT = 300
+RECONNECT_BACKOFF = 0.1
+RECONNECT_BACKOFF_MAX = 5
+HEDGE_DELAY = 0.01
+HEDGE_PERCENTILE = 0.95
+HEDGE_DELAY_REFRESH = 100
+HEDGE_TIMEOUT = 0.5
+HEDGE_POLL_INTERVAL = 0.001
+LATENCY_WINDOW = 1000
+BATCH_WINDOW = 0
+BATCH_SIZE = 64
+PIN_TTL = 0
+PIN_THRESHOLD = 100
+PRELOAD_TTL = 5 * 60
+SHARED_CACHE_TTL = 60
+WRITE_BATCH_SIZE = 100
+WRITE_INTERVAL = 1
+# values copied into the fallback from reads; their real TTL is not known
+FALLBACK_FILL_TTL = 60 * 60
+FALLBACK_FILL_SIZE = 10 * WRITE_BATCH_SIZE
 
 
 class Store:
-    def __init__(self, client_type, address='127.0.0.1', port=None, timeout=20):
+    def __init__(self, client_type, address='127.0.0.1', port=None, timeout=20, codec=None,
+                 pool_size=POOL_SIZE, hedge_delay=None, batch_window=BATCH_WINDOW,
+                 batch_size=BATCH_SIZE, hot_keys_top=TOP_K, pin_ttl=PIN_TTL,
+                 pin_threshold=PIN_THRESHOLD, shared_cache=None, fallback_path=None):
         clients = {
             'memcache': MemCacheClient,
+            'sqlite': SQLiteClient,
         }
-        self.client = clients.get(client_type, MemCacheClient)(address, port, timeout)
+        client_class = clients.get(client_type, MemCacheClient)
+        addresses = address.split(',') if isinstance(address, str) else list(address)
+        replicas = [client_class(replica, port, timeout, pool_size) for replica in addresses]
+        if len(replicas) == 1:
+            self.client = replicas[0]
+        else:
+            self.client = ReplicatedClient(replicas, hedge_delay, pool_size * len(replicas))
+        if fallback_path:
+            self.client = FallbackClient(self.client, SQLiteClient(fallback_path, port, timeout))
         self.retry_count = RETRY_COUNT
+        self.negative_cache = NegativeCache(NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_SIZE)
+        self.codec = codec or BinaryCodec()
+        self.loader = None
+        if batch_window > 0:
+            self.loader = BatchLoader(self.client.get_multi, batch_window, batch_size)
+        self.hot_keys = HotKeyTracker(hot_keys_top) if hot_keys_top else None
+        self.pin_ttl = pin_ttl if self.hot_keys else 0
+        self.pin_threshold = pin_threshold
+        self.pinned = {}
+        self.shared_cache = shared_cache
 
     def _get(self, key):
-        value = self.client.get(key)
+        with tracing.span('store.get', key=key) as span:
+            value = self._lookup(key, span)
+            span.set('hit', value is not None)
+        return value
+
+    def _lookup(self, key, span):
+        value = self._lookup_local(key, span)
+        if value is not None:
+            return value
+        if key in self.negative_cache:
+            span.set('source', 'negative')
+            return None
+        fetch = self.loader.load if self.loader else self.client.get
+        for attempt in range(self.retry_count + 1):
+            with tracing.span('store.fetch', key=key, attempt=attempt):
+                value = fetch(key)
+            if value is not None:
+                break
         if value is None:
-            for _ in range(self.retry_count):
-                value = self.client.get(key)
-                if value is not None:
-                    break
+            self.negative_cache.add(key)
+            return None
+        return self._remember(key, self.codec.decode(value))
+
+    def _lookup_local(self, key, span):
+        if self.hot_keys:
+            self.hot_keys.add(key)
+        if self.pinned:
+            pinned = self.pinned.get(key)
+            if pinned is not None and pinned[1] > time.monotonic():
+                span.set('source', 'pinned')
+                return pinned[0]
+        if self._is_shared(key):
+            value = self.shared_cache.get(key)
+            if value is not None:
+                span.set('source', 'shared')
+                return value
+        return None
+
+    def _remember(self, key, value):
+        if self._is_shared(key) and type(value) in (int, float):
+            self.shared_cache.set(key, value, SHARED_CACHE_TTL)
+        if self.pin_ttl and self.hot_keys.is_hot(key, self.pin_threshold):
+            self._pin(key, value)
         return value
 
+    def _is_shared(self, key):
+        # only scores fit the shared table, so other keys skip its hashing and locking
+        return self.shared_cache is not None and key.startswith(SCORE_PREFIX)
+
+    def _pin(self, key, value):
+        now = time.monotonic()
+        if key not in self.pinned and len(self.pinned) >= self.hot_keys.top_k:
+            for pinned_key, (_, expires_at) in list(self.pinned.items()):
+                if expires_at <= now:
+                    self.pinned.pop(pinned_key, None)
+            if len(self.pinned) >= self.hot_keys.top_k:
+                return
+        self.pinned[key] = (value, now + self.pin_ttl)
+
+    def warm_up(self):
+        return self.client.warm_up()
+
+    def close(self):
+        self.client.close()
+
+    def preload(self, keys, ttl=PRELOAD_TTL):
+        values = self.client.get_multi(keys)
+        expires_at = time.monotonic() + ttl
+        for key, value in values.items():
+            value = self.codec.decode(value)
+            if self._is_shared(key) and type(value) in (int, float):
+                self.shared_cache.set(key, value, ttl)
+            self.pinned[key] = (value, expires_at)
+        return len(values)
+
+    def stats(self):
+        return {
+            'client': self.client.stats(),
+            'negative_cache': len(self.negative_cache.tombstones),
+            'pinned': len(self.pinned),
+        }
+
     def get(self, key):
         value = self._get(key)
         if value is None:
@@ -30,8 +173,36 @@ class Store:
     def cache_get(self, key):
         return self._get(key)
 
+    def cache_get_many(self, keys):
+        # a single multi-get without retries, for callers that can do without a value
+        values, missing = {}, []
+        with tracing.span('store.get_many', keys=len(keys)) as span:
+            for key in keys:
+                value = self._lookup_local(key, span)
+                if value is not None:
+                    values[key] = value
+                elif key not in self.negative_cache:
+                    missing.append(key)
+            fetched = self.client.get_multi(missing) if missing else {}
+            for key in missing:
+                value = fetched.get(key)
+                if value is None:
+                    self.negative_cache.add(key)
+                else:
+                    values[key] = self._remember(key, self.codec.decode(value))
+            span.set('hits', len(values))
+        return values
+
     def cache_set(self, key, value, time):
-        result = self.client.set(key, value, time)
+        with tracing.span('store.set', key=key):
+            return self._set(key, value, time)
+
+    def _set(self, key, value, time):
+        self.negative_cache.discard(key)
+        self.pinned.pop(key, None)
+        if self._is_shared(key) and type(value) in (int, float):
+            self.shared_cache.set(key, value, time)
+        result = self.client.set(key, self.codec.encode(value), time)
         if result == 0:
             for _ in range(self.retry_count):
                 value = self.client.get(key)
@@ -42,17 +213,642 @@ class Store:
         return True
 
 
+class NegativeCache:
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.tombstones = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        # every method that changes tombstones holds the lock, since _evict iterates over it
+        with self.lock:
+            expires_at = self.tombstones.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self.tombstones[key]
+                return False
+            return True
+
+    def add(self, key):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if len(self.tombstones) >= self.size:
+                self._evict()
+            self.tombstones[key] = time.monotonic() + self.ttl
+
+    def discard(self, key):
+        with self.lock:
+            self.tombstones.pop(key, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, expires_at in self.tombstones.items() if expires_at < now]:
+            del self.tombstones[key]
+        while len(self.tombstones) >= self.size:
+            del self.tombstones[next(iter(self.tombstones))]
+
+
+class BatchLoader:
+    def __init__(self, load_many, window=BATCH_WINDOW, max_size=BATCH_SIZE):
+        self.load_many = load_many
+        self.window = window
+        self.max_size = max_size
+        self.condition = threading.Condition()
+        self.batch = None
+
+    def load(self, key):
+        # the first caller of a batch waits out the window, then fetches for everyone
+        with self.condition:
+            leader = self.batch is None
+            if leader:
+                self.batch = {}
+            future = self.batch.get(key)
+            if future is None:
+                future = self.batch[key] = futures.Future()
+            if len(self.batch) >= self.max_size:
+                self.condition.notify_all()
+            if leader:
+                self.condition.wait_for(lambda: len(self.batch) >= self.max_size, self.window)
+                batch, self.batch = self.batch, None
+        if leader:
+            self._dispatch(batch)
+        return future.result()
+
+    def _dispatch(self, batch):
+        try:
+            values = self.load_many(list(batch))
+        except Exception as err:
+            for future in batch.values():
+                future.set_exception(err)
+            return
+        for key, future in batch.items():
+            future.set_result(values.get(key))
+
+
+class ConnectionPool:
+    def __init__(self, factory, check, close, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 backoff=RECONNECT_BACKOFF, max_backoff=RECONNECT_BACKOFF_MAX):
+        self.factory = factory
+        self.check = check
+        self.close = close
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # LIFO stack of (connection, released_at), the oldest idle connection first
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+        self.failures = 0
+        self.next_reconnect = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self.slots:
+            connection = self._checkout()
+            try:
+                yield connection
+            finally:
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+
+    def drain(self):
+        with self.lock:
+            connections, self.idle = self.idle, []
+        for connection, _ in connections:
+            self.close(connection)
+
+    def warm_up(self):
+        with self.lock:
+            connections = [connection for connection, _ in self.idle]
+            self.idle = []
+        while len(connections) < self.size:
+            connections.append(self.factory())
+        healthy = sum(1 for connection in connections if self.check(connection))
+        with self.lock:
+            self.idle.extend((connection, time.monotonic()) for connection in connections)
+        return healthy
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.idle and now - self.idle[0][1] > self.idle_timeout:
+                self.close(self.idle.pop(0)[0])
+            connection = self.idle.pop()[0] if self.idle else None
+        if connection is None:
+            connection = self.factory()
+        if now >= self.next_reconnect:
+            if not self.check(connection):
+                connection = self._reconnect(connection, now)
+            elif self.failures:
+                # the check itself may have reconnected
+                self.failures = 0
+        return connection
+
+    def _reconnect(self, connection, now):
+        self.close(connection)
+        connection = self.factory()
+        if self.check(connection):
+            self.failures = 0
+            self.next_reconnect = 0
+        else:
+            self.failures += 1
+            self.next_reconnect = now + min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        return connection
+
+
+class Hedge:
+    # a backup read that a primary read starts once its server has been silent for delay;
+    # the primary then waits at most timeout more for either answer
+    def __init__(self, executor, read, delay, timeout=HEDGE_TIMEOUT):
+        self.executor = executor
+        self.read = read
+        self.delay = max(delay, HEDGE_POLL_INTERVAL)
+        self.timeout = timeout
+        self.future = None
+        self.expires_at = None
+
+    def fire(self):
+        self.future = self.executor.submit(self.read)
+        self.expires_at = time.monotonic() + self.timeout
+
+    def won(self):
+        # any answer counts, a miss included, but a failed backup read does not
+        future = self.future
+        return future is not None and future.done() and future.exception() is None
+
+    def result(self):
+        return self.future.result() if self.won() else {}
+
+
+class ReplicatedClient:
+    def __init__(self, replicas, hedge_delay=None, hedge_workers=None, hedge_timeout=HEDGE_TIMEOUT):
+        self.replicas = replicas
+        # a fixed delay disables the percentile estimate
+        self.fixed_delay = hedge_delay
+        self.hedge_delay = HEDGE_DELAY if hedge_delay is None else hedge_delay
+        self.hedge_timeout = hedge_timeout
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        # primary reads run on the caller's thread, so only backup reads and writes wait here
+        self.executor = futures.ThreadPoolExecutor(max_workers=hedge_workers or 2 * len(replicas))
+        self.lock = threading.Lock()
+        self.samples = 0
+        self.counters = {'reads': 0, 'hedges_fired': 0, 'hedges_won': 0}
+
+    def warm_up(self):
+        return sum(replica.warm_up() for replica in self.replicas)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for replica in self.replicas:
+            replica.close()
+
+    def is_available(self):
+        return any(replica.is_available() for replica in self.replicas)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['hedge_delay'] = self.hedge_delay
+        stats['replicas'] = [replica.stats() for replica in self.replicas]
+        return stats
+
+    def get(self, key):
+        return self.get_multi([key]).get(key)
+
+    def get_multi(self, keys):
+        with self.lock:
+            self.counters['reads'] += 1
+            reads = self.counters['reads']
+        primary = self.replicas[reads % len(self.replicas)]
+        backup = self.replicas[(reads + 1) % len(self.replicas)]
+        # the backup read gets a short timeout so that a losing one frees its thread soon
+        read = functools.partial(backup.get_multi, keys, timeout=self.hedge_timeout)
+        hedge = Hedge(self.executor, read, self.hedge_delay, self.hedge_timeout)
+        started_at = time.monotonic()
+        values = primary.get_multi(keys, hedge=hedge)
+        if hedge.future is not None:
+            with self.lock:
+                self.counters['hedges_fired'] += 1
+            # the primary gives up its read once the hedge has an answer
+            if not values and hedge.won():
+                values = hedge.result()
+                with self.lock:
+                    self.counters['hedges_won'] += 1
+        self._record_latency(time.monotonic() - started_at)
+        return values
+
+    def set(self, key, value, time_to_live):
+        # replicas are written side by side and the caller waits only for the first to
+        # store the value; a slow replica finishes in the background within hedge_timeout
+        pending = {self.executor.submit(replica.set, key, value, time_to_live, self.hedge_timeout)
+                   for replica in self.replicas}
+        deadline = time.monotonic() + self.hedge_timeout
+        while pending:
+            done, pending = futures.wait(pending, max(deadline - time.monotonic(), 0),
+                                         return_when=futures.FIRST_COMPLETED)
+            if not done:
+                return 0
+            if any(future.exception() is None and future.result() for future in done):
+                return True
+        return False
+
+    def _record_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.samples += 1
+            if self.fixed_delay is not None or self.samples % HEDGE_DELAY_REFRESH:
+                return
+            ordered = sorted(self.latencies)
+        self.hedge_delay = ordered[int(len(ordered) * HEDGE_PERCENTILE) - 1]
+
+
+class MemcacheConnection:
+    # python-memcached clients are thread-local, so pooling them shares no sockets
+    # between threads; this speaks the text protocol over one socket instead
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.socket = None
+        self.socket_timeout = None
+        self.buffer = bytearray()
+        self.used_at = 0
+
+    def connect(self):
+        if self.socket is None:
+            try:
+                self.socket = socket.create_connection((self.host, self.port), self.timeout)
+            except OSError:
+                return False
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket_timeout = self.timeout
+            self.used_at = time.monotonic()
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        self.buffer.clear()
+
+    def is_alive(self):
+        if self.socket is None:
+            return self.connect()
+        # a socket used recently is trusted without a round trip
+        if time.monotonic() - self.used_at < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            self._set_timeout(self.timeout)
+            self.socket.sendall(b'version\r\n')
+            alive = self._readline().startswith(b'VERSION ')
+        except OSError:
+            alive = False
+        if not alive:
+            self.close()
+            return self.connect()
+        self.used_at = time.monotonic()
+        return True
+
+    def get(self, key):
+        return self.get_multi([key]).get(key)
+
+    def get_multi(self, keys, hedge=None, timeout=None):
+        # keys memcached would reject read as misses, so Store.get raises IOError for them
+        encoded_keys = [encoded for encoded in map(self._key, keys) if encoded is not None]
+        if not encoded_keys or self.socket is None:
+            return {}
+        request = b'get ' + b' '.join(encoded_keys) + b'\r\n'
+        found = []
+        try:
+            self._set_timeout(timeout or self.timeout)
+            self.socket.sendall(request)
+            if hedge is not None:
+                self._set_timeout(hedge.delay)
+            line = self._readline(hedge)
+            while line != b'END':
+                reply, key, flags, size = line.split()
+                if reply != b'VALUE':
+                    raise ValueError(f'Unexpected memcached reply: {line!r}')
+                found.append((key.decode('utf-8'), int(flags), self._read(int(size) + 2, hedge)[:-2]))
+                line = self._readline(hedge)
+        except (OSError, ValueError):
+            # a failed read leaves the stream out of step, so the socket is dropped
+            self.close()
+            return {}
+        self.used_at = time.monotonic()
+        return {key: self._load(data, flags) for key, flags, data in found}
+
+    def set(self, key, value, time_to_live, timeout=None):
+        encoded_key = self._key(key)
+        if encoded_key is None or self.socket is None:
+            return 0
+        data, flags = self._dump(value)
+        request = b'set %s %d %d %d\r\n' % (encoded_key, flags, int(time_to_live), len(data))
+        try:
+            self._set_timeout(timeout or self.timeout)
+            self.socket.sendall(request + data + b'\r\n')
+            stored = self._readline() == b'STORED'
+        except OSError:
+            self.close()
+            return 0
+        self.used_at = time.monotonic()
+        return stored
+
+    def _set_timeout(self, timeout):
+        if timeout != self.socket_timeout:
+            self.socket.settimeout(timeout)
+            self.socket_timeout = timeout
+
+    def _readline(self, hedge=None):
+        while True:
+            end = self.buffer.find(b'\r\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 2]
+                return line
+            self._receive(hedge)
+
+    def _read(self, size, hedge=None):
+        while len(self.buffer) < size:
+            self._receive(hedge)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _receive(self, hedge):
+        while True:
+            try:
+                chunk = self.socket.recv(RECV_SIZE)
+                break
+            except socket.timeout:
+                # a silent server fires the hedge, then the read polls until either side answers;
+                # giving up closes the socket, which is what cancels this read
+                if hedge is None or hedge.won():
+                    raise
+                if hedge.future is None:
+                    hedge.fire()
+                    self._set_timeout(HEDGE_POLL_INTERVAL)
+                elif time.monotonic() >= hedge.expires_at:
+                    raise
+        if not chunk:
+            raise ConnectionError('memcached closed the connection')
+        self.buffer += chunk
+
+    @staticmethod
+    def _key(key):
+        encoded = key.encode('utf-8')
+        return encoded if MEMCACHE_KEY.fullmatch(encoded) else None
+
+    @staticmethod
+    def _dump(value):
+        value_type = type(value)
+        if value_type is bytes:
+            return value, 0
+        if value_type is str:
+            return value.encode('utf-8'), FLAG_TEXT
+        if value_type is int:
+            return b'%d' % value, FLAG_INTEGER
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), FLAG_PICKLE
+
+    @staticmethod
+    def _load(data, flags):
+        if flags & FLAG_COMPRESSED:
+            data = zlib.decompress(data)
+        if flags & FLAG_TEXT:
+            return data.decode('utf-8')
+        if flags & (FLAG_INTEGER | FLAG_LONG):
+            return int(data)
+        if flags & FLAG_PICKLE:
+            return pickle.loads(data)
+        return data
+
+
 class MemCacheClient:
-    def __init__(self, ip_address, port, timeout):
-        self.port = port or MEMCACHE_PORT
-        self.connection = self.get_connection(ip_address, timeout)
+    def __init__(self, ip_address, port, timeout, pool_size=POOL_SIZE):
+        self.host = ip_address
+        self.port = int(port or MEMCACHE_PORT)
+        self.timeout = timeout
+        self.pool = ConnectionPool(self.get_connection, MemcacheConnection.is_alive,
+                                   MemcacheConnection.close, pool_size)
+
+    def get_connection(self):
+        return MemcacheConnection(self.host, self.port, self.timeout)
+
+    def warm_up(self):
+        return self.pool.warm_up()
+
+    def close(self):
+        self.pool.drain()
+
+    def get(self, key):
+        with self.pool.connection() as connection:
+            return connection.get(key)
+
+    def is_available(self):
+        return self.pool.failures == 0
+
+    def stats(self):
+        return {'idle_connections': len(self.pool.idle), 'reconnect_failures': self.pool.failures}
+
+    def get_multi(self, keys, hedge=None, timeout=None):
+        with self.pool.connection() as connection:
+            return connection.get_multi(keys, hedge, timeout)
+
+    def set(self, key, value, time, timeout=None):
+        with self.pool.connection() as connection:
+            return connection.set(key, value, time, timeout)
+
+
+class SQLiteClient:
+    # flags column values
+    BYTES, TEXT, PICKLE = 0, 1, 2
+
+    def __init__(self, path, port=None, timeout=20, pool_size=None):
+        self.path = path
+        self.timeout = timeout
+        self.connection = None
+        self.lock = threading.RLock()
+        self.pending = {}
+        # rows stored only where the table has none, see add()
+        self.pending_adds = {}
+        self.flushed_at = time.monotonic()
+        self.timer = None
 
-    def get_connection(self, ip_address, timeout):
-        address = "{0}:{1}".format(ip_address, self.port)
-        return memcache.Client([address], socket_timeout=timeout)
+    def _connect(self):
+        if self.connection is None:
+            # opened lazily so that pre-forked workers each get their own connection,
+            # and memcache-only servers never import sqlite3
+            import sqlite3
+            self.connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                              isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS store ('
+                                    'key TEXT PRIMARY KEY, value BLOB, flags INTEGER, expires_at REAL'
+                                    ') WITHOUT ROWID')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS store_expires_at ON store (expires_at)')
+        return self.connection
+
+    def warm_up(self):
+        with self.lock:
+            self._connect()
+        return 1
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            if self.pending or self.pending_adds:
+                self.flush()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def is_available(self):
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'pending_writes': len(self.pending) + len(self.pending_adds)}
 
     def get(self, key):
-        return self.connection.get(key)
+        return self.get_multi([key]).get(key)
+
+    def get_multi(self, keys, hedge=None, timeout=None):
+        # reads are local, so a hedge never fires
+        now = time.time()
+        values, missing = {}, []
+        with self.lock:
+            self._flush_if_due()
+            for key in keys:
+                row = self.pending.get(key) or self.pending_adds.get(key)
+                if row is None:
+                    missing.append(key)
+                elif row[2] is None or row[2] > now:
+                    values[key] = self._load(row[0], row[1])
+            if missing:
+                placeholders = ','.join('?' * len(missing))
+                rows = self._connect().execute(
+                    f'SELECT key, value, flags FROM store WHERE key IN ({placeholders}) '
+                    'AND (expires_at IS NULL OR expires_at > ?)', missing + [now])
+                for key, value, flags in rows:
+                    values[key] = self._load(value, flags)
+        return values
+
+    def set(self, key, value, time_to_live, timeout=None):
+        expires_at = time.time() + time_to_live if time_to_live else None
+        with self.lock:
+            self.pending[key] = self._dump(value) + (expires_at,)
+            self.pending_adds.pop(key, None)
+            if len(self.pending) >= WRITE_BATCH_SIZE:
+                self.flush()
+            else:
+                self._flush_if_due()
+                self._schedule_flush()
+        return True
+
+    def add(self, key, value, time_to_live):
+        # stores the value only where the key has none; callers on the read path never
+        # flush, and once the buffer is full further values are dropped until the timer runs
+        expires_at = time.time() + time_to_live if time_to_live else None
+        with self.lock:
+            if key in self.pending or len(self.pending_adds) >= FALLBACK_FILL_SIZE:
+                return False
+            self.pending_adds[key] = self._dump(value) + (expires_at,)
+            self._schedule_flush()
+        return True
+
+    def _flush_if_due(self):
+        if self.pending and time.monotonic() - self.flushed_at >= WRITE_INTERVAL:
+            self.flush()
+
+    def _schedule_flush(self):
+        # flushes writes that no later get or set would; a timer does not survive a
+        # fork, so a dead one is replaced
+        if self.timer is None or not self.timer.is_alive():
+            self.timer = threading.Timer(WRITE_INTERVAL, self._flush_on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_on_timer(self):
+        with self.lock:
+            self.timer = None
+            if self.pending or self.pending_adds:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            rows = [(key,) + row for key, row in self.pending.items()]
+            added = [(key,) + row for key, row in self.pending_adds.items()]
+            self.pending, self.pending_adds = {}, {}
+            self.flushed_at = time.monotonic()
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN')
+                connection.execute('DELETE FROM store WHERE expires_at <= ?', (time.time(),))
+                connection.executemany('INSERT OR REPLACE INTO store (key, value, flags, expires_at) '
+                                       'VALUES (?, ?, ?, ?)', rows)
+                connection.executemany('INSERT OR IGNORE INTO store (key, value, flags, expires_at) '
+                                       'VALUES (?, ?, ?, ?)', added)
+
+    def _dump(self, value):
+        if type(value) is bytes:
+            return value, self.BYTES
+        if type(value) is str:
+            return value.encode('utf-8'), self.TEXT
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.PICKLE
+
+    def _load(self, value, flags):
+        if flags == self.TEXT:
+            return value.decode('utf-8')
+        if flags == self.PICKLE:
+            return pickle.loads(value)
+        return value
+
+
+class FallbackClient:
+    # writes go through to both tiers and hits are copied into the fallback where it
+    # has no value yet, since loaders fill memcached directly; reads use the fallback
+    # only while the primary is unreachable, so a plain miss is still a miss
+    def __init__(self, primary, fallback, fill_ttl=FALLBACK_FILL_TTL):
+        self.primary = primary
+        self.fallback = fallback
+        self.fill_ttl = fill_ttl
+
+    def warm_up(self):
+        return self.primary.warm_up() + self.fallback.warm_up()
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+
+    def is_available(self):
+        return True
+
+    def stats(self):
+        return {'primary': self.primary.stats(), 'fallback': self.fallback.stats()}
+
+    def get(self, key):
+        return self.get_multi([key]).get(key)
+
+    def get_multi(self, keys):
+        try:
+            values = self.primary.get_multi(keys)
+        except Exception:
+            return self.fallback.get_multi(keys)
+        for key, value in values.items():
+            self.fallback.add(key, value, self.fill_ttl)
+        if len(values) < len(keys) and not self.primary.is_available():
+            values.update(self.fallback.get_multi([key for key in keys if key not in values]))
+        return values
 
-    def set(self, key, value, time):
-        return self.connection.set(key, value, time)
+    def set(self, key, value, time_to_live):
+        try:
+            result = self.primary.set(key, value, time_to_live)
+        except Exception:
+            result = 0
+        return self.fallback.set(key, value, time_to_live) or result
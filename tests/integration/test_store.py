@@ -29,8 +29,8 @@ class MemcacheTestCase(unittest.TestCase):
 
 class CloseConnectionMemcacheTestCase(unittest.TestCase):
     def setUp(self):
-        self.wrong_store = store.Store('memcache')
-        self.wrong_store.client.connection.buckets.pop()
+        # nothing listens on port 1, so every connection attempt is refused
+        self.wrong_store = store.Store('memcache', port=1)
 
     def test_cache_set(self):
         self.assertEqual(self.wrong_store.cache_set('key', 'value', 60), 0)
@@ -1,4 +1,11 @@
+import datetime
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
 import unittest
+import zlib
 import api
 import functools
 
@@ -238,6 +245,46 @@ class BirthDayFieldTestCase(unittest.TestCase):
         self.assertEquals(field.errors, [error])
 
 
+class ParseDateTestCase(unittest.TestCase):
+
+    @cases([
+        '13.02.2023', '1.1.2000', ' 1.01.2000', '29.02.2000', '29.02.1900', '31.04.2020', '00.01.2000',
+        '01.00.2000', '01.13.2000', '32.01.2000', '01.01.0000', '01.01.200', '01.01.20000', '1.1.٢٠٠٠',
+        '01.01.2000\n', ' 01.01.2000', '01-01-2000', '', 13.2023, None, ('01.01.2000',),
+    ])
+    def test_matches_strptime(self, case):
+        try:
+            expected = datetime.datetime.strptime(case, '%d.%m.%Y').date()
+        except (ValueError, TypeError) as err:
+            expected = type(err)
+        try:
+            parsed = api.parse_date(case)
+        except (ValueError, TypeError) as err:
+            parsed = type(err)
+        self.assertEqual(parsed, expected)
+
+    def test_unhashable_value(self):
+        with self.assertRaises(TypeError):
+            api.parse_date([1, 2, 3])
+
+
+class BirthDayCutoffTestCase(unittest.TestCase):
+    def tearDown(self):
+        api.BirthDayField.cutoff_expires_at = 0
+
+    def test_cutoff(self):
+        expected = datetime.datetime.now().date() - datetime.timedelta(days=365 * 70)
+        self.assertEqual(api.BirthDayField.get_cutoff(), expected)
+        self.assertGreater(api.BirthDayField.cutoff_expires_at, datetime.datetime.now().timestamp())
+
+    def test_cutoff_is_refreshed_after_midnight(self):
+        api.BirthDayField.get_cutoff()
+        api.BirthDayField.cutoff = datetime.date(1900, 1, 1)
+        self.assertEqual(api.BirthDayField.get_cutoff(), datetime.date(1900, 1, 1))
+        api.BirthDayField.cutoff_expires_at = 0
+        self.assertNotEqual(api.BirthDayField.get_cutoff(), datetime.date(1900, 1, 1))
+
+
 class GenderFieldTestCase(unittest.TestCase):
 
     @cases([
@@ -405,5 +452,112 @@ class TestSuiteWithStore(unittest.TestCase):
         self.assertEqual(api.INVALID_REQUEST, code)
 
 
+class CompressionTestCase(unittest.TestCase):
+
+    @cases([
+        (None, None),
+        ('', None),
+        ('identity', None),
+        ('gzip', 'gzip'),
+        ('deflate', 'deflate'),
+        ('br, deflate, gzip', 'gzip'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('gzip; q=0, *', 'deflate'),
+        ('*;q=0.1', 'gzip'),
+        ('GZIP;q=bad', None),
+    ])
+    def test_choose_encoding(self, case):
+        header, encoding = case
+        self.assertEqual(api.choose_encoding(header), encoding)
+
+    def test_compress(self):
+        body = b'{"response": {}}' * 100
+        self.assertEqual(gzip.decompress(api.compress(body, 'gzip')), body)
+        self.assertEqual(zlib.decompress(api.compress(body, 'deflate')), body)
+
+
+class WarmUpStore:
+    def __init__(self, healthy):
+        self.healthy = list(healthy)
+        self.preloaded = None
+
+    def warm_up(self):
+        return self.healthy.pop(0)
+
+    def preload(self, keys):
+        self.preloaded = keys
+        return len(keys)
+
+
+class WarmUpTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ready = threading.Event()
+
+    def test_ready_after_warm_up(self):
+        store = WarmUpStore([0, 2])
+        api.WARM_UP_RETRY_DELAY, delay = 0, api.WARM_UP_RETRY_DELAY
+        try:
+            api.warm_up_store(store, self.ready)
+        finally:
+            api.WARM_UP_RETRY_DELAY = delay
+        self.assertFalse(store.healthy)
+        self.assertTrue(self.ready.is_set())
+
+    def test_preload(self):
+        store = WarmUpStore([1])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.txt')
+            with open(path, 'w', encoding='utf-8') as keys_file:
+                keys_file.write('i:1\n\ni:2\n')
+            api.warm_up_store(store, self.ready, path)
+        self.assertEqual(store.preloaded, ['i:1', 'i:2'])
+
+    def test_validators(self):
+        api.warm_up_validators()
+
+    def test_missing_preload_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertLogs(level='ERROR'):
+                api.warm_up_store(WarmUpStore([1]), self.ready, os.path.join(directory, 'missing.txt'))
+        self.assertTrue(self.ready.is_set())
+
+
+class HotKeysTestCase(unittest.TestCase):
+    method = "hot_keys"
+
+    def setUp(self):
+        self.store = api.Store(api.DEFAULT_CACHE_CLIENT, api.DEFAULT_CACHE_ADDRESS)
+        self.store.hot_keys.add('i:1')
+
+    def get_response(self, login, token):
+        request = {"account": "horns&hoofs", "login": login, "method": self.method, "token": token, "arguments": {}}
+        return api.method_handler({"body": request, "headers": {}}, {}, self.store)
+
+    def test_admin(self):
+        temp = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+        response, code = self.get_response(api.ADMIN_LOGIN, hashlib.sha512(temp.encode('utf-8')).hexdigest())
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response['keys'][0]['key'], 'i:1')
+
+    def test_not_admin(self):
+        token = hashlib.sha512(("horns&hoofs" + "vasya" + api.SALT).encode('utf-8')).hexdigest()
+        _, code = self.get_response("vasya", token)
+        self.assertEqual(api.FORBIDDEN, code)
+
+
+class StoreStatsTestCase(HotKeysTestCase):
+    method = "store_stats"
+
+    def setUp(self):
+        self.store = api.Store(api.DEFAULT_CACHE_CLIENT, '127.0.0.1,127.0.0.2', hedge_delay=1)
+
+    def test_admin(self):
+        temp = datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT
+        response, code = self.get_response(api.ADMIN_LOGIN, hashlib.sha512(temp.encode('utf-8')).hexdigest())
+        self.assertEqual(api.OK, code)
+        self.assertEqual(response['client']['hedges_fired'], 0)
+        self.assertEqual(len(response['client']['replicas']), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,108 @@
+import datetime
+import hashlib
+import unittest
+import cache_keys
+import scoring
+
+
+class FakeStore:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.calls = 0
+
+    def get(self, key):
+        return self.data[key]
+
+    def cache_get(self, key):
+        self.calls += 1
+        return self.data.get(key)
+
+    def cache_get_many(self, keys):
+        self.calls += 1
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    def cache_set(self, key, value, time):
+        self.data[key] = value
+
+
+class ScoreKeyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.person = ('Вася', 'Пупкин', '79175002040', datetime.date(1990, 1, 1))
+
+    def test_key_is_compact_and_versioned(self):
+        key = cache_keys.score_key(*self.person)
+        self.assertEqual(key[:3], f"s{cache_keys.SCORING_VERSION}:")
+        self.assertEqual(len(key), 3 + 16)
+        self.assertEqual(cache_keys.score_key(*self.person, version=2), 's2:' + key[3:])
+
+    def test_fields_do_not_run_together(self):
+        self.assertNotEqual(cache_keys.score_key('ab', 'c'), cache_keys.score_key('a', 'bc'))
+
+    def test_integer_phone(self):
+        self.assertEqual(cache_keys.score_key(phone=79175002040), cache_keys.score_key(phone='79175002040'))
+
+    def test_legacy_key(self):
+        self.assertEqual(cache_keys.legacy_score_key(*self.person),
+                         'uid:' + hashlib.md5('ВасяПупкин7917500204019900101'.encode()).hexdigest())
+
+    def test_dual_read(self):
+        keys = cache_keys.score_keys(*self.person, dual_read=cache_keys.DUAL_READ)
+        self.assertEqual(keys, [cache_keys.score_key(*self.person), cache_keys.legacy_score_key(*self.person)])
+        self.assertEqual(cache_keys.score_keys(*self.person, dual_read=()), keys[:1])
+
+
+class DualReadTestCase(unittest.TestCase):
+    def tearDown(self):
+        cache_keys.enable_dual_read(0)
+
+    def test_off_by_default(self):
+        self.assertEqual(cache_keys.score_keys(phone='79175002040'), [cache_keys.score_key(phone='79175002040')])
+
+    def test_enabled_for_a_period(self):
+        cache_keys.enable_dual_read(60)
+        self.assertEqual(len(cache_keys.score_keys(phone='79175002040')), 2)
+        cache_keys.enable_dual_read(-1)
+        self.assertEqual(len(cache_keys.score_keys(phone='79175002040')), 1)
+
+
+class GetScoreTestCase(unittest.TestCase):
+    def setUp(self):
+        cache_keys.enable_dual_read(60)
+
+    def tearDown(self):
+        cache_keys.enable_dual_read(0)
+
+    def test_legacy_score_is_migrated(self):
+        legacy_key = cache_keys.legacy_score_key(phone='79175002040')
+        store = FakeStore({legacy_key: 4.0})
+        self.assertEqual(scoring.get_score(store, '79175002040', 'a@b.c'), 4.0)
+        self.assertEqual(store.data[cache_keys.score_key(phone='79175002040')], 4.0)
+
+    def test_score_is_computed_and_cached(self):
+        store = FakeStore()
+        self.assertEqual(scoring.get_score(store, '79175002040', 'a@b.c'), 3.0)
+        self.assertEqual(list(store.data), [cache_keys.score_key(phone='79175002040')])
+
+    def test_keys_are_read_in_one_call(self):
+        store = FakeStore()
+        scoring.get_score(store, '79175002040', 'a@b.c')
+        self.assertEqual(store.calls, 1)
+
+
+class GetInterestsTestCase(unittest.TestCase):
+    def test_json_is_parsed(self):
+        for value in ('["cars", "books"]', b'["cars", "books"]'):
+            store = FakeStore({'i:1': value})
+            self.assertEqual(scoring.get_interests(store, 1), ['cars', 'books'])
+
+    def test_decoded_list(self):
+        self.assertEqual(scoring.get_interests(FakeStore({'i:1': ['cars']}), 1), ['cars'])
+
+    def test_set_interests(self):
+        store = FakeStore()
+        scoring.set_interests(store, 1, ('cars', 'books'))
+        self.assertEqual(scoring.get_interests(store, 1), ['cars', 'books'])
+
+
+if __name__ == "__main__":
+    unittest.main()
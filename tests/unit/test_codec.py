@@ -0,0 +1,78 @@
+import json
+import pickle
+import unittest
+import codec
+
+
+class BinaryCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.codec = codec.BinaryCodec()
+
+    def test_round_trip(self):
+        for value in (0, 3.5, 0.1, 1e300, -1, 2 ** 70, ['cars', 'книги'], ['a\0b'], [], ('a',), {'key': 'value'}, True):
+            decoded = self.codec.decode(self.codec.encode(value))
+            self.assertEqual(decoded, list(value) if isinstance(value, tuple) else value)
+            self.assertIs(type(decoded), list if isinstance(value, tuple) else type(value))
+
+    def test_text_is_not_encoded(self):
+        self.assertEqual(self.codec.encode('["cars"]'), '["cars"]')
+        self.assertEqual(self.codec.decode('["cars"]'), '["cars"]')
+
+    def test_foreign_bytes_pass_through(self):
+        for value in (b'["cars", "books"]', b' []', b'\n{}'):
+            self.assertEqual(self.codec.decode(value), value)
+
+    def test_version_byte(self):
+        self.assertEqual(self.codec.encode(1.5)[0], codec.VERSION)
+        with self.assertRaises(ValueError):
+            self.codec.decode(bytes([codec.VERSION + 1, codec.KIND_FLOAT]) + codec.FLOAT.pack(1.5))
+
+    def test_compression(self):
+        value = ['interest'] * 200
+        encoded = self.codec.encode(value)
+        self.assertTrue(encoded[1] & codec.COMPRESSED)
+        self.assertEqual(self.codec.decode(encoded), value)
+
+    def test_smaller_than_pickle_and_json(self):
+        interests = ['cars', 'pets', 'travel']
+        self.assertLessEqual(len(self.codec.encode(1.5)), len(pickle.dumps(1.5, 0)))
+        self.assertLessEqual(len(self.codec.encode(interests)), len(json.dumps(interests)))
+
+
+class VocabularyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.codec = codec.BinaryCodec()
+
+    def test_known_tags_are_packed_as_ids(self):
+        interests = ['cars', 'otus', 'books']
+        encoded = self.codec.encode(interests)
+        self.assertEqual(encoded[1], codec.KIND_TAG_IDS)
+        self.assertEqual(len(encoded), codec.HEADER.size + len(interests))
+        self.assertEqual(self.codec.decode(encoded), interests)
+
+    def test_unknown_tag_falls_back_to_strings(self):
+        interests = ['cars', 'knitting']
+        encoded = self.codec.encode(interests)
+        self.assertEqual(encoded[1], codec.KIND_STRINGS)
+        self.assertEqual(self.codec.decode(encoded), interests)
+
+    def test_decoded_lists_are_not_shared(self):
+        encoded = self.codec.encode(['cars'])
+        self.codec.decode(encoded).append('pets')
+        self.assertEqual(self.codec.decode(encoded), ['cars'])
+
+    def test_no_vocabulary(self):
+        plain = codec.BinaryCodec(vocabulary=None)
+        encoded = plain.encode(['cars'])
+        self.assertEqual(encoded[1], codec.KIND_STRINGS)
+        self.assertEqual(plain.decode(encoded), ['cars'])
+        with self.assertRaises(ValueError):
+            plain.decode(self.codec.encode(['cars']))
+
+    def test_unknown_id(self):
+        with self.assertRaises(ValueError):
+            self.codec.decode(codec.HEADER.pack(codec.VERSION, codec.KIND_TAG_IDS) + b'\xff')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import hotkeys
+
+
+class CountMinSketchTestCase(unittest.TestCase):
+    def test_estimate_never_undercounts(self):
+        sketch = hotkeys.CountMinSketch(width=16, depth=3)
+        for number in range(100):
+            sketch.add(f'uid:{number % 10}')
+        for number in range(10):
+            self.assertGreaterEqual(sketch.estimate(f'uid:{number}'), 10)
+
+
+class HotKeyTrackerTestCase(unittest.TestCase):
+    def test_top_keys(self):
+        tracker = hotkeys.HotKeyTracker(top_k=2)
+        for key, hits in (('i:1', 5), ('i:2', 1), ('i:3', 3), ('i:4', 2)):
+            for _ in range(hits):
+                tracker.add(key)
+        self.assertEqual([item['key'] for item in tracker.top_keys()], ['i:1', 'i:3'])
+        self.assertEqual(tracker.top_keys(limit=1)[0]['count'], 5)
+
+    def test_is_hot(self):
+        tracker = hotkeys.HotKeyTracker(top_k=2)
+        for _ in range(3):
+            tracker.add('i:1')
+        self.assertTrue(tracker.is_hot('i:1', 3))
+        self.assertFalse(tracker.is_hot('i:1', 4))
+        self.assertFalse(tracker.is_hot('i:2', 1))
+
+    def test_window_resets_counts(self):
+        tracker = hotkeys.HotKeyTracker(window=-1)
+        tracker.add('i:1')
+        tracker.add('i:1')
+        self.assertEqual(tracker.top_keys()[0]['count'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
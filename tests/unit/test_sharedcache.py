@@ -0,0 +1,44 @@
+import os
+import unittest
+import sharedcache
+
+
+class SharedScoreCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = sharedcache.SharedScoreCache(slots=8, stripes=2)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('uid:1'))
+        self.cache.set('uid:1', 3.5)
+        self.cache.set('uid:1', 4.5)
+        self.assertEqual(self.cache.get('uid:1'), 4.5)
+
+    def test_int_score(self):
+        self.cache.set('uid:1', 0)
+        self.assertIs(type(self.cache.get('uid:1')), int)
+        self.assertEqual(self.cache.get('uid:1'), 0)
+
+    def test_expired(self):
+        self.cache.set('uid:1', 3.5, ttl=-1)
+        self.assertIsNone(self.cache.get('uid:1'))
+
+    def test_full_bucket_evicts(self):
+        for number in range(100):
+            self.cache.set(f'uid:{number}', float(number), ttl=number + 1)
+        self.assertEqual(self.cache.get('uid:99'), 99.0)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_shared_between_processes(self):
+        pid = os.fork()
+        if pid == 0:
+            self.cache.set('uid:1', 2.5)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.cache.get('uid:1'), 2.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,483 @@
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from concurrent import futures
+import sharedcache
+import store
+from cache_keys import SCORE_PREFIX
+
+
+class FakeClient:
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.calls = 0
+        self.timeouts = []
+        self.available = True
+
+    def get(self, key):
+        self.calls += 1
+        return self.data.get(key)
+
+    def get_multi(self, keys, hedge=None, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    def is_available(self):
+        return self.available
+
+    def stats(self):
+        return {'calls': self.calls}
+
+    def set(self, key, value, time, timeout=None):
+        self.data[key] = value
+        return True
+
+
+class NegativeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = store.Store('memcache')
+        self.store.client = FakeClient({'zero': 0})
+
+    def test_missing_key_is_fetched_once(self):
+        for _ in range(3):
+            with self.assertRaises(IOError):
+                self.store.get('i:1')
+        self.assertEqual(self.store.client.calls, store.RETRY_COUNT + 1)
+
+    def test_zero_value_is_a_hit(self):
+        self.assertEqual(self.store.cache_get('zero'), 0)
+        self.assertEqual(self.store.client.calls, 1)
+
+    def test_cache_set_clears_tombstone(self):
+        self.assertIsNone(self.store.cache_get('key'))
+        self.store.cache_set('key', 1.5, 60)
+        self.assertEqual(self.store.cache_get('key'), 1.5)
+
+    def test_tombstone_expires(self):
+        self.store.negative_cache.tombstones['key'] = 0
+        self.assertFalse('key' in self.store.negative_cache)
+
+    def test_size_is_bounded(self):
+        negative_cache = store.NegativeCache(60, 2)
+        for key in ('a', 'b', 'c'):
+            negative_cache.add(key)
+        self.assertEqual(list(negative_cache.tombstones), ['b', 'c'])
+
+
+class GetManyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = store.Store('memcache')
+        self.store.client = FakeClient({'a': 1.5})
+
+    def test_one_fetch_without_retries(self):
+        self.assertEqual(self.store.cache_get_many(['a', 'b']), {'a': 1.5})
+        self.assertEqual(self.store.client.calls, 1)
+
+    def test_misses_are_tombstoned(self):
+        self.store.cache_get_many(['b'])
+        self.assertEqual(self.store.cache_get_many(['b']), {})
+        self.assertEqual(self.store.client.calls, 1)
+
+
+class FakeConnection:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+        self.alive = True
+        self.pool = store.ConnectionPool(self.factory, lambda c: c.alive and not c.closed, self.close, size=2)
+
+    def factory(self):
+        connection = FakeConnection(self.alive)
+        self.created.append(connection)
+        return connection
+
+    @staticmethod
+    def close(connection):
+        connection.closed = True
+
+    def test_connection_is_reused(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(len(self.created), 1)
+
+    def test_warm_up(self):
+        self.assertEqual(self.pool.warm_up(), 2)
+        with self.pool.connection(), self.pool.connection():
+            pass
+        self.assertEqual(len(self.created), 2)
+
+    def test_idle_connections_are_evicted(self):
+        with self.pool.connection() as first:
+            pass
+        self.pool.idle_timeout = -1
+        with self.pool.connection() as second:
+            pass
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+
+    def test_unhealthy_connection_is_replaced(self):
+        with self.pool.connection() as first:
+            pass
+        first.alive = False
+        with self.pool.connection() as second:
+            pass
+        self.assertTrue(first.closed)
+        self.assertTrue(second.alive)
+
+    def test_reconnect_backs_off(self):
+        self.alive = False
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.created), 2)
+        self.assertEqual(self.pool.failures, 1)
+        with self.pool.connection():
+            pass
+        self.assertEqual(len(self.created), 2)
+
+    def test_recovery_resets_failures(self):
+        self.alive = False
+        with self.pool.connection() as connection:
+            pass
+        connection.alive = True
+        self.pool.next_reconnect = 0
+        with self.pool.connection():
+            pass
+        self.assertEqual(self.pool.failures, 0)
+
+
+class MemcacheConnectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.connection = store.MemcacheConnection('127.0.0.1', store.MEMCACHE_PORT, 1)
+        self.connection.socket, self.server = socket.socketpair()
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.close()
+
+    def test_get_multi(self):
+        self.server.sendall(b'VALUE a 16 2\r\nhi\r\nVALUE b 2 1\r\n7\r\nVALUE c 0 2\r\n\x01\x02\r\nEND\r\n')
+        self.assertEqual(self.connection.get_multi(['a', 'b', 'c', 'd']), {'a': 'hi', 'b': 7, 'c': b'\x01\x02'})
+        self.assertEqual(self.server.recv(100), b'get a b c d\r\n')
+
+    def test_set(self):
+        self.server.sendall(b'STORED\r\n')
+        self.assertTrue(self.connection.set('key', [1.5], 60))
+        header, data = self.server.recv(1000).split(b'\r\n', 1)
+        self.assertEqual(header.split()[:4], [b'set', b'key', b'%d' % store.FLAG_PICKLE, b'60'])
+        self.assertEqual(pickle.loads(data[:-2]), [1.5])
+
+    def test_values_round_trip(self):
+        for value in (b'\x00', 'text', 7, [1.5, 'cars']):
+            self.assertEqual(self.connection._load(*self.connection._dump(value)), value)
+
+    def test_broken_connection_is_dropped(self):
+        self.server.close()
+        self.assertEqual(self.connection.get_multi(['a']), {})
+        self.assertIsNone(self.connection.socket)
+        self.assertEqual(self.connection.set('a', 1, 60), 0)
+
+    def test_invalid_key(self):
+        self.assertIsNone(self.connection.get('bad key'))
+        self.assertEqual(self.connection.set('x' * 251, 1, 60), 0)
+        self.server.sendall(b'VALUE a 2 1\r\n7\r\nEND\r\n')
+        self.assertEqual(self.connection.get_multi(['a', 'bad key']), {'a': 7})
+        self.assertEqual(self.server.recv(100), b'get a\r\n')
+
+    def test_fast_reply_does_not_hedge(self):
+        self.server.sendall(b'END\r\n')
+        hedge = store.Hedge(None, None, 1)
+        self.assertEqual(self.connection.get_multi(['a'], hedge), {})
+        self.assertIsNone(hedge.future)
+        self.assertIsNotNone(self.connection.socket)
+
+    def test_silent_server_fires_hedge(self):
+        backup = FakeClient({'a': 'backup'})
+        with futures.ThreadPoolExecutor(1) as executor:
+            hedge = store.Hedge(executor, lambda: backup.get_multi(['a']), 0.01)
+            self.assertEqual(self.connection.get_multi(['a'], hedge), {})
+        self.assertTrue(hedge.won())
+        # the losing read is cancelled by dropping its socket
+        self.assertIsNone(self.connection.socket)
+
+    def test_backup_miss_ends_the_read(self):
+        self.connection.timeout = 5
+        with futures.ThreadPoolExecutor(1) as executor:
+            hedge = store.Hedge(executor, lambda: {}, 0.01)
+            started_at = time.monotonic()
+            self.assertEqual(self.connection.get_multi(['a'], hedge), {})
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertTrue(hedge.won())
+
+    def test_failed_backup_waits_for_hedge_timeout(self):
+        def fail():
+            raise OSError('backup is down')
+        self.connection.timeout = 5
+        with futures.ThreadPoolExecutor(1) as executor:
+            hedge = store.Hedge(executor, fail, 0.01, timeout=0.05)
+            started_at = time.monotonic()
+            self.assertEqual(self.connection.get_multi(['a'], hedge), {})
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertFalse(hedge.won())
+
+
+class MemCacheClientTestCase(unittest.TestCase):
+    def test_warm_connections_are_shared_between_threads(self):
+        with socket.create_server(('127.0.0.1', 0)) as listener:
+            client = store.MemCacheClient('127.0.0.1', listener.getsockname()[1], 1, pool_size=1)
+            self.assertEqual(client.warm_up(), 1)
+            accepted, _ = listener.accept()
+            sockets = []
+
+            def check_out():
+                with client.pool.connection() as connection:
+                    sockets.append(connection.socket)
+            thread = threading.Thread(target=check_out)
+            thread.start()
+            thread.join()
+            listener.setblocking(False)
+            with self.assertRaises(BlockingIOError):
+                listener.accept()
+            self.assertIs(sockets[0], client.pool.idle[0][0].socket)
+            accepted.close()
+            client.pool.idle[0][0].close()
+
+
+class SilentClient(FakeClient):
+    # a replica whose server never answers: it fires the hedge and gives up once that has won
+    def __init__(self, data=None):
+        super().__init__(data)
+        self.released = threading.Event()
+
+    def get_multi(self, keys, hedge=None, timeout=None):
+        self.calls += 1
+        hedge.fire()
+        hedge.future.result()
+        return {}
+
+    def set(self, key, value, time, timeout=None):
+        # the write hangs until the test releases it or it times out
+        self.released.wait(timeout)
+        return 0
+
+
+class ReplicatedClientTestCase(unittest.TestCase):
+    def test_writes_go_to_every_replica(self):
+        replicas = [FakeClient(), FakeClient()]
+        client = store.ReplicatedClient(replicas)
+        self.assertTrue(client.set('key', 1, 60))
+        client.executor.shutdown()
+        self.assertEqual([replica.data for replica in replicas], [{'key': 1}, {'key': 1}])
+
+    def test_slow_replica_does_not_stall_writes(self):
+        replicas = [SilentClient(), FakeClient()]
+        client = store.ReplicatedClient(replicas, hedge_timeout=5)
+        started_at = time.monotonic()
+        self.assertTrue(client.set('key', 1, 60))
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertEqual(replicas[1].data, {'key': 1})
+        replicas[0].released.set()
+
+    def test_writes_give_up_after_hedge_timeout(self):
+        client = store.ReplicatedClient([SilentClient(), SilentClient()], hedge_timeout=0.05)
+        self.assertFalse(client.set('key', 1, 60))
+
+    def test_missing_key_is_hedged_once(self):
+        client = store.ReplicatedClient([FakeClient(), SilentClient()], hedge_delay=0.01)
+        self.assertIsNone(client.get('key'))
+        self.assertEqual(client.stats()['hedges_won'], 1)
+
+    def test_fast_reads_are_not_hedged(self):
+        client = store.ReplicatedClient([FakeClient({'key': 1}), FakeClient({'key': 1})], hedge_delay=1)
+        self.assertEqual(client.get('key'), 1)
+        self.assertEqual(client.counters, {'reads': 1, 'hedges_fired': 0, 'hedges_won': 0})
+
+    def test_slow_read_is_hedged(self):
+        fast = FakeClient({'key': 'fast'})
+        # the first read goes to replicas[1]
+        client = store.ReplicatedClient([fast, SilentClient({'key': 'slow'})], hedge_delay=0.01)
+        self.assertEqual(client.get('key'), 'fast')
+        self.assertEqual(fast.timeouts, [store.HEDGE_TIMEOUT])
+        stats = client.stats()
+        self.assertEqual((stats['hedges_fired'], stats['hedges_won']), (1, 1))
+        self.assertEqual(stats['replicas'], [{'calls': 1}, {'calls': 1}])
+
+    def test_delay_follows_latency_percentile(self):
+        client = store.ReplicatedClient([FakeClient(), FakeClient()])
+        for latency in range(store.HEDGE_DELAY_REFRESH):
+            client._record_latency(latency / 1000)
+        self.assertEqual(client.hedge_delay, 0.094)
+
+
+class BatchLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient({'a': 1, 'b': 2})
+
+    def load_concurrently(self, loader, keys):
+        results = {}
+        threads = [threading.Thread(target=lambda k=key: results.__setitem__(k, loader.load(k))) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_loads_share_one_fetch(self):
+        loader = store.BatchLoader(self.client.get_multi, window=0.2, max_size=3)
+        results = self.load_concurrently(loader, ['a', 'b', 'c'])
+        self.assertEqual(results, {'a': 1, 'b': 2, 'c': None})
+        self.assertEqual(self.client.calls, 1)
+
+    def test_errors_reach_every_waiter(self):
+        def load_many(keys):
+            raise IOError('down')
+        loader = store.BatchLoader(load_many, window=0)
+        with self.assertRaises(IOError):
+            loader.load('a')
+
+    def test_store_reads_through_loader(self):
+        cache = store.Store('memcache', batch_window=0.001)
+        cache.client = self.client
+        cache.loader.load_many = self.client.get_multi
+        self.assertEqual(cache.cache_get('a'), 1)
+        self.assertEqual(self.client.calls, 1)
+
+
+class HotKeyPinningTestCase(unittest.TestCase):
+    def test_hot_key_is_served_locally(self):
+        cache = store.Store('memcache', pin_ttl=60, pin_threshold=2)
+        cache.client = FakeClient({'i:1': 'value'})
+        for _ in range(4):
+            self.assertEqual(cache.get('i:1'), 'value')
+        self.assertEqual(cache.client.calls, 2)
+
+    def test_write_unpins(self):
+        cache = store.Store('memcache', pin_ttl=60, pin_threshold=1)
+        cache.client = FakeClient({'key': 1})
+        cache.cache_get('key')
+        cache.cache_set('key', 2, 60)
+        self.assertEqual(cache.cache_get('key'), 2)
+
+
+class SharedCacheTierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shared_cache = sharedcache.SharedScoreCache(slots=8, stripes=1)
+        self.store = store.Store('memcache', shared_cache=self.shared_cache)
+        self.store.client = FakeClient()
+
+    def tearDown(self):
+        self.shared_cache.close()
+
+    def test_scores_are_served_from_shared_memory(self):
+        for score in (1.5, 0):
+            self.store.cache_set(SCORE_PREFIX + '1', score, 60)
+            self.store.client.data.clear()
+            self.assertEqual(self.store.cache_get(SCORE_PREFIX + '1'), score)
+        self.assertEqual(self.store.client.calls, 0)
+
+    def test_other_keys_skip_shared_memory(self):
+        self.store.cache_set('i:1', ['cars'], 60)
+        self.store.cache_set('i:2', 3, 60)
+        self.assertIsNone(self.shared_cache.get('i:1'))
+        self.assertIsNone(self.shared_cache.get('i:2'))
+
+
+class PreloadTestCase(unittest.TestCase):
+    def test_preloaded_keys_are_served_locally(self):
+        cache = store.Store('memcache')
+        cache.client = FakeClient({'i:1': cache.codec.encode(['cars']), 'i:2': 'x'})
+        self.assertEqual(cache.preload(['i:1', 'i:2', 'i:3']), 2)
+        calls = cache.client.calls
+        self.assertEqual(cache.get('i:1'), ['cars'])
+        self.assertEqual(cache.client.calls, calls)
+
+
+class SQLiteClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'store.db')
+        self.client = store.SQLiteClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.directory.cleanup()
+
+    def test_values_survive_reopen(self):
+        for key, value in (('bytes', b'\x01\x05'), ('text', '["cars"]'), ('int', 7)):
+            self.client.set(key, value, 60)
+        self.client.flush()
+        reopened = store.SQLiteClient(self.path)
+        self.assertEqual(reopened.get_multi(['bytes', 'text', 'int', 'none']),
+                         {'bytes': b'\x01\x05', 'text': '["cars"]', 'int': 7})
+
+    def test_pending_writes_are_readable(self):
+        self.client.set('key', 'value', 60)
+        self.assertTrue(self.client.pending)
+        self.assertEqual(self.client.get('key'), 'value')
+
+    def test_expired(self):
+        self.client.set('key', 'value', -1)
+        self.assertIsNone(self.client.get('key'))
+        self.client.flush()
+        self.assertIsNone(self.client.get('key'))
+
+    def test_standalone_store(self):
+        cache = store.Store('sqlite', self.path)
+        cache.cache_set('uid:1', 2.5, 60)
+        self.assertEqual(cache.get('uid:1'), 2.5)
+
+    def test_fallback_tier(self):
+        primary = FakeClient()
+        client = store.FallbackClient(primary, self.client)
+        self.assertTrue(client.set('i:1', 'value', 60))
+        self.assertTrue(client.set('i:2', 'expired', -1))
+        self.assertEqual(primary.data, {'i:1': 'value', 'i:2': 'expired'})
+        primary.data.clear()
+        # a miss on a reachable primary is a miss
+        self.assertIsNone(client.get('i:1'))
+        primary.available = False
+        self.assertEqual(client.get_multi(['i:1', 'i:2']), {'i:1': 'value'})
+
+    def test_reads_fill_missing_keys(self):
+        primary = FakeClient({'i:1': 'loaded', 'i:2': 'stale'})
+        client = store.FallbackClient(primary, self.client)
+        self.client.set('i:2', 'written', 60)
+        self.client.flush()
+        self.assertEqual(client.get_multi(['i:1', 'i:2']), {'i:1': 'loaded', 'i:2': 'stale'})
+        self.assertEqual(self.client.pending, {})
+        self.client.flush()
+        primary.data.clear()
+        primary.available = False
+        # loader-written keys survive an outage, and a fill never replaces a write
+        self.assertEqual(client.get_multi(['i:1', 'i:2']), {'i:1': 'loaded', 'i:2': 'written'})
+
+    def test_timer_flushes_writes(self):
+        store.WRITE_INTERVAL, interval = 0.01, store.WRITE_INTERVAL
+        try:
+            self.client.set('key', 'value', 60)
+            self.client.timer.join(1)
+        finally:
+            store.WRITE_INTERVAL = interval
+        self.assertEqual(self.client.pending, {})
+        self.assertEqual(store.SQLiteClient(self.path).get('key'), 'value')
+
+    def test_close_flushes_writes(self):
+        self.client.set('key', 'value', 60)
+        self.client.close()
+        self.assertEqual(store.SQLiteClient(self.path).get('key'), 'value')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+import store
+import tracing
+
+
+class ListExporter:
+    def __init__(self):
+        self.records = []
+
+    def export(self, record):
+        self.records.append(record)
+
+
+class MissingClient:
+    def get(self, key):
+        return None
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        self.tracer = tracing.Tracer(self.exporter)
+
+    def test_spans_outside_trace_are_not_recorded(self):
+        self.assertIs(tracing.span('store.get'), tracing.NULL_SPAN)
+        self.assertIs(tracing.Tracer().start_trace('request'), tracing.NULL_SPAN)
+
+    def test_children_share_trace(self):
+        with self.tracer.start_trace('request', trace_id='a' * 32, parent_id='b' * 16) as root:
+            with tracing.span('handler'):
+                with tracing.span('store.get', key='uid:1'):
+                    pass
+        store_span, handler_span, root_span = self.exporter.records
+        self.assertEqual({record['trace_id'] for record in self.exporter.records}, {'a' * 32})
+        self.assertEqual(root_span['parent_id'], 'b' * 16)
+        self.assertEqual(handler_span['parent_id'], root.span_id)
+        self.assertEqual(store_span['parent_id'], handler_span['span_id'])
+        self.assertEqual(store_span['attributes'], {'key': 'uid:1'})
+
+    def test_error_is_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.start_trace('request'):
+                raise ValueError('boom')
+        self.assertEqual(self.exporter.records[0]['error'], 'ValueError: boom')
+
+    def test_store_retries_are_traced(self):
+        cache = store.Store('memcache')
+        cache.client = MissingClient()
+        with self.tracer.start_trace('request'):
+            cache.cache_get('uid:1')
+        names = [record['name'] for record in self.exporter.records]
+        self.assertEqual(names, ['store.fetch'] * (store.RETRY_COUNT + 1) + ['store.get', 'request'])
+
+    def test_parse_traceparent(self):
+        header = '00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01'
+        self.assertEqual(tracing.parse_traceparent(header),
+                         ('4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'))
+        self.assertEqual(tracing.parse_traceparent('garbage'), (None, None))
+        self.assertEqual(tracing.parse_traceparent(None), (None, None))
+
+
+class JsonLinesExporterTestCase(unittest.TestCase):
+    def test_batches_are_written_as_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.jsonl')
+            exporter = tracing.JsonLinesExporter(path, batch_size=2, interval=60)
+            exporter.export({'name': 'parse'})
+            self.assertFalse(os.path.exists(path))
+            exporter.export({'name': 'auth'})
+            with open(path, encoding='utf-8') as trace_file:
+                self.assertEqual([json.loads(line)['name'] for line in trace_file], ['parse', 'auth'])
+
+    def test_timer_writes_idle_spans(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.jsonl')
+            exporter = tracing.JsonLinesExporter(path, batch_size=100, interval=0.01)
+            exporter.export({'name': 'parse'})
+            exporter.timer.join(1)
+            with open(path, encoding='utf-8') as trace_file:
+                self.assertEqual([json.loads(line)['name'] for line in trace_file], ['parse'])
+
+
+if __name__ == "__main__":
+    unittest.main()
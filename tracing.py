@@ -0,0 +1,156 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+EXPORT_BATCH_SIZE = 100
+EXPORT_INTERVAL = 1
+
+_local = threading.local()
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+def current_span():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def span(name, **attributes):
+    parent = current_span()
+    if parent is None:
+        return NULL_SPAN
+    return Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+
+
+def parse_traceparent(header):
+    # W3C trace context: version-trace_id-parent_id-flags
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.span_id = _new_id(8)
+        self.attributes = attributes
+        self.started_at = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(self)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _local.stack.pop()
+        self.tracer.export(self)
+        return False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class Tracer:
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    def start_trace(self, name, trace_id=None, parent_id=None, **attributes):
+        if self.exporter is None:
+            return NULL_SPAN
+        return Span(self, name, trace_id or _new_id(16), parent_id, attributes)
+
+    def export(self, finished_span):
+        self.exporter.export(finished_span.to_dict())
+
+    def flush(self):
+        if self.exporter is not None:
+            self.exporter.flush()
+
+
+class JsonLinesExporter:
+    def __init__(self, path, batch_size=EXPORT_BATCH_SIZE, interval=EXPORT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.flushed_at = time.monotonic()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def export(self, record):
+        with self.lock:
+            self.buffer.append(record)
+            if len(self.buffer) < self.batch_size and time.monotonic() - self.flushed_at < self.interval:
+                self._schedule_flush()
+                return
+        self.flush()
+
+    def _schedule_flush(self):
+        # writes out spans that no later export would, e.g. before an idle period;
+        # a timer does not survive a fork, so a dead one is replaced
+        if self.timer is None or not self.timer.is_alive():
+            self.timer = threading.Timer(self.interval, self._flush_on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_on_timer(self):
+        with self.lock:
+            self.timer = None
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer = self.buffer, []
+            self.flushed_at = time.monotonic()
+            if not records:
+                return
+            lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+            with open(self.path, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(lines)